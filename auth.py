@@ -4,21 +4,47 @@ Authentication module for dashboard access
 from fastapi import HTTPException, Depends, status, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from config import settings
+from cachetools import TTLCache
+import hashlib
+import redis
 import secrets
+import threading
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Tuple
 import logging
 
 # Initialize HTTP Basic Auth
 security = HTTPBasic()
 
-# Track failed login attempts (in-memory for simplicity)
-failed_attempts: Dict[str, int] = {}
-blocked_ips: Dict[str, datetime] = {}
+# Block for 15 minutes after 5 failed attempts
+MAX_FAILED_ATTEMPTS = 5
+BLOCK_SECONDS = 900
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Failed authentications take at least this long (plus up to 20ms of jitter),
+# so the blocked and bad-credentials paths can't be told apart by timing
+AUTH_FAILURE_DELAY = 0.05
+
+# Track failed login attempts (in-memory, bounded so a distributed
+# brute-force can't grow them without limit; entries expire on their own)
+failed_attempts: TTLCache = TTLCache(maxsize=16384, ttl=BLOCK_SECONDS)
+blocked_ips: TTLCache = TTLCache(maxsize=16384, ttl=BLOCK_SECONDS)
+# TTLCache is not thread-safe and sync dependencies run in the threadpool
+_attempts_lock = threading.Lock()
+
+# Shared counters in Redis when configured, so limits hold across workers,
+# replicas and restarts; the TTL caches above are the local dev fallback
+_redis = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True) if settings.REDIS_URL else None
+# Blocks already seen in Redis, mapped to their monotonic expiry, so a banned
+# IP hammering the dashboard is rejected without a Redis round-trip
+_known_blocks: TTLCache = TTLCache(maxsize=16384, ttl=BLOCK_SECONDS)
+
+# Digests of the dashboard credentials, computed once at startup
+_USERNAME_HASH = hashlib.sha256(settings.DASHBOARD_USERNAME.encode()).digest()
+_PASSWORD_HASH = hashlib.sha256(settings.DASHBOARD_PASSWORD.encode()).digest()
+
+# Child of the application logger, which owns handlers and level
+logger = logging.getLogger("clickfast.auth")
 
 
 def get_client_ip(request: Request) -> str:
@@ -29,27 +55,64 @@ def get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
+def _pad_failure(started: float):
+    """Sleep until AUTH_FAILURE_DELAY plus random jitter has elapsed since started"""
+    target = AUTH_FAILURE_DELAY + secrets.randbelow(20) / 1000
+    remaining = target - (time.perf_counter() - started)
+    if remaining > 0:
+        time.sleep(remaining)
+
+
 def is_ip_blocked(ip: str) -> bool:
     """Check if IP is temporarily blocked due to failed attempts"""
-    if ip in blocked_ips:
-        # Block for 15 minutes after 5 failed attempts
-        blocked_time = blocked_ips[ip]
-        if (datetime.now() - blocked_time).seconds < 900:  # 15 minutes
-            return True
-        else:
-            # Unblock after timeout
-            del blocked_ips[ip]
-            failed_attempts[ip] = 0
-    return False
+    if _redis is not None:
+        with _attempts_lock:
+            if _known_blocks.get(ip, 0) > time.monotonic():
+                return True
+        remaining_ms = _redis.pttl(f"auth:block:{ip}")
+        if remaining_ms <= 0:
+            return False
+        with _attempts_lock:
+            _known_blocks[ip] = time.monotonic() + remaining_ms / 1000
+        return True
+    
+    with _attempts_lock:
+        return ip in blocked_ips
 
 
 def record_failed_attempt(ip: str):
     """Record failed login attempt and block if necessary"""
-    failed_attempts[ip] = failed_attempts.get(ip, 0) + 1
+    if _redis is not None:
+        pipe = _redis.pipeline()
+        pipe.incr(f"auth:fail:{ip}")
+        pipe.expire(f"auth:fail:{ip}", BLOCK_SECONDS)
+        attempts = pipe.execute()[0]
+        if attempts >= MAX_FAILED_ATTEMPTS:
+            pipe.setex(f"auth:block:{ip}", BLOCK_SECONDS, datetime.now().isoformat())
+            pipe.delete(f"auth:fail:{ip}")
+            pipe.execute()
+            with _attempts_lock:
+                _known_blocks[ip] = time.monotonic() + BLOCK_SECONDS
+    else:
+        with _attempts_lock:
+            attempts = failed_attempts[ip] = failed_attempts.get(ip, 0) + 1
+            if attempts >= MAX_FAILED_ATTEMPTS:
+                blocked_ips[ip] = datetime.now()
+                # Start from zero once the block expires
+                del failed_attempts[ip]
+    
+    if attempts >= MAX_FAILED_ATTEMPTS:
+        logger.warning("🚫 IP %s blocked due to multiple failed login attempts", ip)
+
+
+def reset_failed_attempts(ip: str):
+    """Clear failed login attempts after a successful login"""
+    if _redis is not None:
+        _redis.delete(f"auth:fail:{ip}")
+        return
     
-    if failed_attempts[ip] >= 5:
-        blocked_ips[ip] = datetime.now()
-        logger.warning(f"🚫 IP {ip} blocked due to multiple failed login attempts")
+    with _attempts_lock:
+        failed_attempts.pop(ip, None)
 
 
 def authenticate_dashboard(credentials: HTTPBasicCredentials = Depends(security), request: Request = None):
@@ -66,28 +129,33 @@ def authenticate_dashboard(credentials: HTTPBasicCredentials = Depends(security)
     Raises:
         HTTPException: 401 if authentication fails or IP is blocked
     """
+    started = time.perf_counter()
     client_ip = get_client_ip(request) if request else "unknown"
     
     # Check if IP is blocked
     if is_ip_blocked(client_ip):
-        logger.warning(f"🚫 Blocked IP {client_ip} attempted dashboard access")
+        logger.warning("🚫 Blocked IP %s attempted dashboard access", client_ip)
+        _pad_failure(started)
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="IP temporariamente bloqueado devido a múltiplas tentativas de login falharam",
             headers={"WWW-Authenticate": "Basic realm=\"Dashboard\""},
         )
     
-    # Use constant-time comparison to prevent timing attacks
-    correct_username = secrets.compare_digest(
-        credentials.username, settings.DASHBOARD_USERNAME
-    )
-    correct_password = secrets.compare_digest(
-        credentials.password, settings.DASHBOARD_PASSWORD
+    # Compare fixed-length digests in constant time so neither the result nor
+    # the length of the configured credentials leaks through timing; '&' keeps
+    # both comparisons running even when the username is already wrong
+    username_hash = hashlib.sha256(credentials.username.encode()).digest()
+    password_hash = hashlib.sha256(credentials.password.encode()).digest()
+    authenticated = (
+        secrets.compare_digest(username_hash, _USERNAME_HASH)
+        & secrets.compare_digest(password_hash, _PASSWORD_HASH)
     )
     
-    if not (correct_username and correct_password):
+    if not authenticated:
         record_failed_attempt(client_ip)
-        logger.warning(f"🚫 Failed dashboard login attempt from IP {client_ip} with username '{credentials.username}'")
+        logger.warning("🚫 Failed dashboard login attempt from IP %s with username '%s'", client_ip, credentials.username)
+        _pad_failure(started)
         
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -96,10 +164,9 @@ def authenticate_dashboard(credentials: HTTPBasicCredentials = Depends(security)
         )
     
     # Reset failed attempts on successful login
-    if client_ip in failed_attempts:
-        failed_attempts[client_ip] = 0
+    reset_failed_attempts(client_ip)
     
-    logger.info(f"✅ Successful dashboard login from IP {client_ip} with username '{credentials.username}'")
+    logger.info("✅ Successful dashboard login from IP %s with username '%s'", client_ip, credentials.username)
     return credentials.username
 
 
@@ -107,6 +174,7 @@ def is_authenticated(credentials: HTTPBasicCredentials = Depends(security), requ
     """
     Check if credentials are valid without raising exception
     Enhanced with IP tracking and security logging
+    Failures are padded by authenticate_dashboard like any other login
     
     Args:
         credentials: HTTP Basic credentials
@@ -122,9 +190,9 @@ def is_authenticated(credentials: HTTPBasicCredentials = Depends(security), requ
         client_ip = get_client_ip(request) if request else "unknown"
         
         if e.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
-            logger.warning(f"🚫 Blocked IP {client_ip} authentication check failed")
+            logger.warning("🚫 Blocked IP %s authentication check failed", client_ip)
         else:
-            logger.warning(f"🔒 Authentication check failed for IP {client_ip}")
+            logger.warning("🔒 Authentication check failed for IP %s", client_ip)
             
         return False
 
@@ -136,9 +204,28 @@ def get_security_stats() -> Dict:
     Returns:
         Dictionary with security stats
     """
-    return {
-        "failed_attempts": dict(failed_attempts),
-        "blocked_ips": {ip: blocked_time.isoformat() for ip, blocked_time in blocked_ips.items()},
-        "total_blocked_ips": len(blocked_ips),
-        "timestamp": datetime.now().isoformat()
-    }
\ No newline at end of file
+    if _redis is not None:
+        failed = {key.split(":", 2)[2]: int(value) for key, value in _scan_values("auth:fail:*")}
+        blocked = {key.split(":", 2)[2]: value for key, value in _scan_values("auth:block:*")}
+        return {
+            "failed_attempts": failed,
+            "blocked_ips": blocked,
+            "total_blocked_ips": len(blocked),
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    with _attempts_lock:
+        return {
+            "failed_attempts": dict(failed_attempts),
+            "blocked_ips": {ip: blocked_time.isoformat() for ip, blocked_time in blocked_ips.items()},
+            "total_blocked_ips": len(blocked_ips),
+            "timestamp": datetime.now().isoformat()
+        }
+
+
+def _scan_values(pattern: str) -> List[Tuple[str, str]]:
+    """Return (key, value) pairs for Redis keys matching pattern, skipping expired ones"""
+    keys = list(_redis.scan_iter(match=pattern, count=500))
+    if not keys:
+        return []
+    return [(key, value) for key, value in zip(keys, _redis.mget(keys)) if value is not None]
\ No newline at end of file
@@ -21,15 +21,23 @@ class Settings(BaseSettings):
     DASHBOARD_USERNAME: str
     DASHBOARD_PASSWORD: str 
     
+    # Redis for login rate limiting shared across workers (optional)
+    REDIS_URL: Optional[str] = None
+    
     # Conversion Settings
     CONVERSION_NAME: str = "purchase"
     CURRENCY: str = "BRL"
     TIMEZONE: str = "America/Sao_Paulo"
     
+    # Storage Settings
+    CSV_FLUSH_DELAY: float = 2.0  # seconds buffered in memory before writing to R2
+    DASHBOARD_CACHE_TTL: float = 5.0  # seconds a rendered dashboard is reused
+    
     # Application Settings
     APP_NAME: str = "Google Ads Offline Conversions"
     APP_URL: str = "http://localhost:8000"
     DEBUG: bool = False
+    LOG_LEVEL: str = "INFO"  # WARNING in production drops the per-request lines
     
     class Config:
         env_file = ".env"
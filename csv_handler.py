@@ -3,56 +3,192 @@ CSV Handler for managing conversion data and Cloudflare R2 storage
 """
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from cachetools import TTLCache
+import ciso8601
 from io import StringIO, BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import gzip
+import itertools
+import logging
+import re
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import pytz
+from typing import List, Dict, Iterator, Optional, Tuple
+from zoneinfo import ZoneInfo
+import threading
+import time
+import zlib
 from config import settings
 
+# Child of the application logger, which owns handlers and level
+logger = logging.getLogger("clickfast.csv_handler")
+
+
+HEADER = b"Google Click ID,Conversion Name,Conversion Time,Conversion Value,Conversion Currency,Order ID"
+GZIP_MAGIC = b'\x1f\x8b'
+R2_MAX_POOL_CONNECTIONS = 50
+STREAM_CHUNK_SIZE = 64 * 1024
+CLEANUP_WORKERS = 32
+COUNT_WORKERS = 32
+SOURCES_CACHE_TTL = 30  # seconds
+# S3/R2 minimum size for every multipart part except the last
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+# Placeholder row that keeps CSVs non-empty for Google Ads; only the
+# conversion time varies, so the rest is rendered once at import
+_DUMMY_ROW_PREFIX = f"EAIaIQobChMIs6mly9qAkgMV5EFIAB1kbDikEAAYASAAEgK-M_D_BwE,{settings.CONVERSION_NAME},".encode('utf-8')
+_DUMMY_ROW_SUFFIX = f",1074.36,{settings.CURRENCY},44867721".encode('utf-8')
+_NEEDS_QUOTING_RE = re.compile(r'[",\r\n]')
+# Lines that are not conversion rows: parameters, header and blank lines
+_SKIP_LINE_RE = re.compile(rb'(?:Parameters:|Google Click ID|\s*$)')
+_CONVERSION_TIME_RE = re.compile(rb'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+
+
+# Shared R2 client: boto3 clients are thread-safe, and reusing one keeps its
+# pooled keep-alive connections instead of paying a TLS handshake per client
+_S3 = boto3.client(
+    's3',
+    endpoint_url=f'https://{settings.R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
+    aws_access_key_id=settings.R2_ACCESS_KEY_ID,
+    aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
+    config=Config(
+        signature_version='s3v4',
+        max_pool_connections=R2_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=2,
+        read_timeout=5,
+        retries={'max_attempts': 3, 'mode': 'adaptive'}
+    ),
+    region_name='auto'
+)
+
+
+def _format_row(fields: List[str]) -> bytes:
+    """
+    Format one UTF-8 encoded CSV row without line terminator
+    Fields with commas or quotes are quoted by csv.writer; line breaks are
+    replaced with spaces so every row stays on a single line
+    
+    Args:
+        fields: Column values in HEADER order
+        
+    Returns:
+        CSV row as bytes
+    """
+    # Fast path: plain fields need no quoting, a join gives the same output
+    if not any(_NEEDS_QUOTING_RE.search(field) for field in fields):
+        return ','.join(fields).encode('utf-8')
+    
+    buffer = StringIO()
+    csv.writer(buffer, lineterminator='').writerow(
+        [field.replace('\r', ' ').replace('\n', ' ') for field in fields]
+    )
+    return buffer.getvalue().encode('utf-8')
+
 
 class R2Storage:
     """Handles Cloudflare R2 storage operations"""
     
     def __init__(self):
         """Initialize R2 client"""
-        self.s3_client = boto3.client(
-            's3',
-            endpoint_url=f'https://{settings.R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
-            aws_access_key_id=settings.R2_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.R2_SECRET_ACCESS_KEY,
-            config=Config(signature_version='s3v4'),
-            region_name='auto'
-        )
+        self.s3_client = _S3
         self.bucket_name = settings.R2_BUCKET_NAME
+        # For Railway or production, you'll need to set APP_URL environment variable
+        # Example: https://seu-app.railway.app
+        self.url_prefix = f"{settings.APP_URL}/csv/{settings.API_KEY}"
         
-    def get_csv(self, src: str) -> Optional[str]:
+    def get_csv_bytes(self, src: str) -> Optional[bytes]:
         """
         Retrieve CSV content from R2
+        Content stays UTF-8 bytes; callers decode only where a str is needed
         
         Args:
             src: Source/Account ID
             
         Returns:
-            CSV content as string, or None if file doesn't exist
+            CSV content as bytes, or None if file doesn't exist
+            
+        Raises:
+            Exception: On errors other than a missing object, so a failed read
+                is never mistaken for an empty account
         """
         key = f"{src}.csv"
         try:
             response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
-            return response['Body'].read().decode('utf-8')
+            body = response['Body'].read()
+            # Objects written before compression was enabled are plain text
+            if body[:2] == GZIP_MAGIC:
+                body = gzip.decompress(body)
+            return body
         except self.s3_client.exceptions.NoSuchKey:
             return None
         except Exception as e:
-            print(f"Error retrieving CSV for {src}: {e}")
+            logger.error("Error retrieving CSV for %s: %s", src, e)
+            raise
+    
+    def iter_csv_bytes(self, src: str, chunk_size: int = STREAM_CHUNK_SIZE,
+                       decompress: bool = True) -> Optional[Iterator[bytes]]:
+        """
+        Stream CSV content from R2, decompressing on the fly
+        The object is fetched eagerly so a missing file is reported as None,
+        but the body is only read as the returned iterator is consumed
+        
+        Args:
+            src: Source/Account ID
+            chunk_size: Bytes read from R2 per chunk
+            decompress: False to yield the stored bytes as-is, e.g. to serve
+                gzip objects to clients that accept gzip
+            
+        Returns:
+            Iterator of CSV chunks, or None if file doesn't exist
+            
+        Raises:
+            Exception: On errors other than a missing object
+        """
+        key = f"{src}.csv"
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        except self.s3_client.exceptions.NoSuchKey:
             return None
+        except Exception as e:
+            logger.error("Error retrieving CSV for %s: %s", src, e)
+            raise
+        return self._iter_body(response['Body'], chunk_size, decompress)
     
-    def save_csv(self, src: str, csv_content: str) -> bool:
+    @staticmethod
+    def _iter_body(body, chunk_size: int, decompress: bool = True) -> Iterator[bytes]:
+        """Yield decompressed chunks of an object body: gzip members or plain text"""
+        decompressor = None
+        plain = not decompress
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                if decompressor is None and not plain:
+                    # Objects written before compression was enabled are plain text
+                    plain = chunk[:2] != GZIP_MAGIC
+                    decompressor = None if plain else zlib.decompressobj(wbits=31)
+                if plain:
+                    yield chunk
+                    continue
+                # Appended history is a multi-member gzip: restart after each member
+                while chunk:
+                    data = decompressor.decompress(chunk)
+                    if data:
+                        yield data
+                    if not decompressor.eof:
+                        break
+                    chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=31)
+        finally:
+            body.close()
+    
+    def save_csv(self, src: str, csv_content: bytes, row_count: int) -> bool:
         """
-        Save CSV content to R2
+        Save CSV content to R2, gzip-compressed at rest
         
         Args:
             src: Source/Account ID
-            csv_content: CSV content as string
+            csv_content: UTF-8 encoded CSV content
+            row_count: Number of data rows, stored so counts only need a HEAD
             
         Returns:
             True if successful, False otherwise
@@ -62,12 +198,113 @@ class R2Storage:
             self.s3_client.put_object(
                 Bucket=self.bucket_name,
                 Key=key,
-                Body=csv_content.encode('utf-8'),
-                ContentType='text/csv'
+                Body=gzip.compress(csv_content, compresslevel=6),
+                ContentType='text/csv',
+                ContentEncoding='gzip',
+                Metadata={'rowcount': str(row_count)}
             )
             return True
         except Exception as e:
-            print(f"Error saving CSV for {src}: {e}")
+            logger.error("Error saving CSV for %s: %s", src, e)
+            return False
+    
+    def get_row_count(self, src: str) -> Optional[int]:
+        """
+        Read the number of data rows from object metadata without downloading it
+        
+        Args:
+            src: Source/Account ID
+            
+        Returns:
+            Row count (0 if the file doesn't exist), or None if unknown
+        """
+        try:
+            response = self.head_csv(src)
+        except Exception as e:
+            logger.error("Error reading metadata for %s: %s", src, e)
+            return None
+        if response is None:
+            return 0
+        row_count = response.get('Metadata', {}).get('rowcount')
+        return int(row_count) if row_count is not None else None
+    
+    def head_csv(self, src: str) -> Optional[Dict]:
+        """
+        Retrieve CSV object metadata from R2
+        
+        Args:
+            src: Source/Account ID
+            
+        Returns:
+            head_object response, or None if file doesn't exist
+            
+        Raises:
+            ClientError: On errors other than a missing object
+        """
+        try:
+            return self.s3_client.head_object(Bucket=self.bucket_name, Key=f"{src}.csv")
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+    
+    def append_csv(self, src: str, csv_content: bytes, row_count: int) -> bool:
+        """
+        Append content to an existing gzip object without downloading it
+        The object is copied server-side as part 1 of a multipart upload and
+        the new content, compressed as a separate gzip member, becomes part 2.
+        Only valid when the object is at least MULTIPART_MIN_PART_SIZE bytes
+        
+        Args:
+            src: Source/Account ID
+            csv_content: UTF-8 encoded content to append
+            row_count: Data row count of the resulting object
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        key = f"{src}.csv"
+        upload_id = None
+        try:
+            upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                ContentType='text/csv',
+                ContentEncoding='gzip',
+                # Several gzip members: valid, but not every HTTP client decodes it
+                Metadata={'rowcount': str(row_count), 'multimember': '1'}
+            )['UploadId']
+            copied = self.s3_client.upload_part_copy(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=1,
+                CopySource={'Bucket': self.bucket_name, 'Key': key}
+            )
+            appended = self.s3_client.upload_part(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=2,
+                Body=gzip.compress(csv_content, compresslevel=6)
+            )
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [
+                    {'PartNumber': 1, 'ETag': copied['CopyPartResult']['ETag']},
+                    {'PartNumber': 2, 'ETag': appended['ETag']}
+                ]}
+            )
+            return True
+        except Exception as e:
+            logger.error("Error appending to CSV for %s: %s", src, e)
+            if upload_id:
+                try:
+                    self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+                except Exception:
+                    pass
             return False
     
     def get_public_url(self, src: str) -> str:
@@ -81,14 +318,204 @@ class R2Storage:
         Returns:
             Public URL to access the CSV (format: /csv/{api_key}/{src}.csv)
         """
-        # For Railway or production, you'll need to set APP_URL environment variable
-        # Example: https://seu-app.railway.app
-        app_url = getattr(settings, 'APP_URL', 'http://localhost:8000')
-        
-        # Build URL with API key in path and .csv extension
-        url = f"{app_url}/csv/{settings.API_KEY}/{src}.csv"
-        
-        return url
+        return f"{self.url_prefix}/{src}.csv"
+
+
+class _CsvCache:
+    """
+    In-process write-back cache of CSV files keyed by src
+
+    Rows are kept in memory and written to R2 by a debounced timer, so a
+    burst of conversions for the same account costs a single PUT instead
+    of one GET + PUT per conversion.
+    """
+
+    def __init__(self, storage: R2Storage, flush_delay: float):
+        """
+        Initialize the cache
+
+        Args:
+            storage: R2 storage backend
+            flush_delay: Seconds to wait after the first change before flushing
+        """
+        self.storage = storage
+        self.flush_delay = flush_delay
+        self._entries: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.RLock] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._guard = threading.Lock()
+        # Bumped on every change, lets callers cache data derived from the CSVs
+        self._versions = itertools.count(1)
+        self.version = 0
+        # Entry revisions restart with the process, so ETags also carry its start time
+        self.boot_id = format(time.time_ns(), 'x')
+        # Srcs with an existing entry; replaced, never mutated, so a caller can
+        # tell the set changed with an identity check
+        self._known: frozenset = frozenset()
+
+    def lock(self, src: str) -> threading.RLock:
+        """Return the lock protecting the entry for src"""
+        with self._guard:
+            lock = self._locks.get(src)
+            if lock is None:
+                lock = self._locks[src] = threading.RLock()
+            return lock
+
+    def get(self, src: str) -> Dict:
+        """
+        Return the cached entry for src, loading it from R2 on first access
+        Caller must hold lock(src)
+
+        Args:
+            src: Source/Account ID
+
+        Returns:
+            Dict with 'exists', 'header', 'rows', 'dirty', 'revision'
+            and 'modified' keys
+
+        Raises:
+            Exception: If the CSV couldn't be read from R2; nothing is cached
+        """
+        entry = self._entries.get(src)
+        if entry is None:
+            entry = self._entries[src] = self._load(src)
+            if entry['exists']:
+                self._set_known(src, True)
+        return entry
+
+    def _load(self, src: str) -> Dict:
+        """Load and parse a CSV from R2 into a cache entry"""
+        content = self.storage.get_csv_bytes(src)
+        header = None
+        rows = []
+        if content and content.startswith(HEADER + b'\n'):
+            # Canonical layout written by this app: header, then one row per line
+            header = HEADER
+            rows = [line for line in content[len(HEADER) + 1:].split(b'\n') if line]
+        elif content:
+            # Legacy files may carry Parameters: lines or a different header
+            lines = content.strip().split(b'\n')
+            header = next((line for line in lines if line.startswith(b'Google Click ID')), None)
+            rows = [line for line in lines if not _SKIP_LINE_RE.match(line)]
+        return {
+            'exists': content is not None, 'header': header, 'rows': rows, 'dirty': False,
+            'revision': next(self._versions), 'modified': time.time()
+        }
+
+    def peek(self, src: str) -> Optional[Dict]:
+        """Return the cached entry for src without loading it from R2"""
+        return self._entries.get(src)
+
+    def known_sources(self) -> frozenset:
+        """Return srcs that exist in the cache, including ones not yet flushed"""
+        return self._known
+
+    def _set_known(self, src: str, exists: bool):
+        """Add src to or drop it from the known sources snapshot"""
+        if src.endswith('_history') or (src in self._known) == exists:
+            return
+        with self._guard:
+            self._known = self._known | {src} if exists else self._known - {src}
+
+    def discard(self, src: str):
+        """
+        Drop the entry for src, e.g. after a failed creation
+        Caller must hold lock(src)
+        """
+        self._entries.pop(src, None)
+        self._set_known(src, False)
+
+    @staticmethod
+    def render(entry: Dict) -> bytes:
+        """Serialize a cache entry back to CSV content"""
+        lines = [entry['header']] if entry['header'] else []
+        return b'\n'.join(lines + entry['rows'])
+
+    @staticmethod
+    def render_chunks(header: Optional[bytes], rows: List[bytes], chunk_size: int = 1000) -> Iterator[bytes]:
+        """Serialize header and rows lazily, same output as render() split in chunks"""
+        if header:
+            yield header
+        for start in range(0, len(rows), chunk_size):
+            chunk = b'\n'.join(rows[start:start + chunk_size])
+            yield chunk if start == 0 and not header else b'\n' + chunk
+
+    def mark_dirty(self, src: str):
+        """
+        Flag the entry for src as modified and schedule a flush
+        Caller must hold lock(src)
+        """
+        entry = self._entries[src]
+        if not entry['exists']:
+            self._set_known(src, True)
+        entry['exists'] = True
+        entry['dirty'] = True
+        entry['revision'] = self.version = next(self._versions)
+        entry['modified'] = time.time()
+        with self._guard:
+            if src not in self._timers:
+                timer = threading.Timer(self.flush_delay, self._scheduled_flush, args=(src,))
+                timer.daemon = True
+                self._timers[src] = timer
+                timer.start()
+
+    def _scheduled_flush(self, src: str):
+        """Timer callback, reschedules itself if the write fails"""
+        with self._guard:
+            self._timers.pop(src, None)
+        if not self.flush(src):
+            logger.warning("⚠️ Falha ao gravar CSV de %s no R2, nova tentativa em %ss", src, self.flush_delay)
+            with self.lock(src):
+                self.mark_dirty(src)
+
+    def flush(self, src: str) -> bool:
+        """
+        Write the entry for src to R2 if it has pending changes
+
+        Args:
+            src: Source/Account ID
+
+        Returns:
+            True if nothing was pending or the pending rows were written,
+            False otherwise
+        """
+        # The PUT runs outside lock(src) so a slow R2 doesn't hold up
+        # add_conversion; the flush lock keeps PUTs for a src in order.
+        # Callers must not hold lock(src)
+        with self.lock(f"{src}_flush"):
+            with self.lock(src):
+                entry = self._entries.get(src)
+                if entry is None or not entry['dirty']:
+                    return True
+                content = self.render(entry)
+                row_count = len(entry['rows'])
+                revision = entry['revision']
+            if not self.storage.save_csv(src, content, row_count):
+                return False
+            with self.lock(src):
+                # Changes made during the PUT stay dirty for their own timer
+                if entry['revision'] == revision:
+                    entry['dirty'] = False
+            return True
+
+    def flush_all(self) -> bool:
+        """
+        Cancel pending timers and write every dirty entry to R2
+        Used on application shutdown
+
+        Returns:
+            True if every entry was written successfully
+        """
+        with self._guard:
+            timers = list(self._timers.values())
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+
+        ok = True
+        for src in list(self._entries):
+            ok = self.flush(src) and ok
+        return ok
 
 
 class CSVHandler:
@@ -97,7 +524,22 @@ class CSVHandler:
     def __init__(self):
         """Initialize CSV handler with R2 storage"""
         self.storage = R2Storage()
-        self.timezone = pytz.timezone(settings.TIMEZONE)
+        self.cache = _CsvCache(self.storage, settings.CSV_FLUSH_DELAY)
+        self._sources_cache: TTLCache = TTLCache(maxsize=1, ttl=SOURCES_CACHE_TTL)
+        self._sources_lock = threading.Lock()
+        # Last get_all_sources result per include_history, with the listing and
+        # known sources it was built from
+        self._sources_snapshot: Dict[bool, Tuple] = {}
+        # Archived conversions per src; recent ones are counted from the cache
+        self._history_counts: Dict[str, int] = {}
+        self.timezone = ZoneInfo(settings.TIMEZONE)
+        # Base for public CSV URLs: {url_prefix}/{src}.csv
+        self.url_prefix = self.storage.url_prefix
+    
+    @property
+    def version(self) -> int:
+        """Counter that changes whenever any conversion data changes"""
+        return self.cache.version
     
     def create_empty_source(self, src: str) -> bool:
         """
@@ -105,31 +547,45 @@ class CSVHandler:
         O registro fictício evita que o Google Ads reclame de arquivo vazio.
         Retorna True se criado com sucesso ou já existir, False em caso de erro.
         """
-        existing_csv = self.storage.get_csv(src)
-        if existing_csv:
-            # Já existe, não sobrescreve
-            return True
-        
-        # Cria CSV com header e um registro fictício padrão
-        header = "Google Click ID,Conversion Name,Conversion Time,Conversion Value,Conversion Currency,Order ID\n"
-        
-        # Registro fictício padrão (data antiga para ser removido na próxima limpeza)
-        dummy_time = (datetime.now(self.timezone) - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-        dummy_row = f"EAIaIQobChMIs6mly9qAkgMV5EFIAB1kbDikEAAYASAAEgK-M_D_BwE,{settings.CONVERSION_NAME},{dummy_time},1074.36,{settings.CURRENCY},44867721\n"
-        
-        csv_content = header + dummy_row
+        with self.cache.lock(src):
+            try:
+                entry = self.cache.get(src)
+            except Exception as e:
+                logger.error("Erro ao verificar CSV de %s: %s", src, e)
+                return False
+            if entry['exists']:
+                # Já existe, não sobrescreve
+                return True
+            
+            # Cria CSV com header e um registro fictício padrão
+            # (data antiga para ser removido na próxima limpeza)
+            entry['header'] = HEADER
+            entry['rows'] = [self._dummy_row()]
+            self.cache.mark_dirty(src)
+            revision = entry['revision']
         
-        try:
-            return self.storage.save_csv(src, csv_content)
-        except Exception as e:
-            print(f"Erro ao criar CSV para {src}: {e}")
+        # Grava imediatamente para a conta aparecer na listagem do dashboard
+        if not self.cache.flush(src):
+            logger.error("Erro ao criar CSV para %s", src)
+            with self.cache.lock(src):
+                # Conversões recebidas nesse meio tempo ficam para o timer gravar
+                if self.cache.peek(src) is entry and entry['revision'] == revision:
+                    self.cache.discard(src)
             return False
+        return True
+    
+    def _dummy_row(self) -> bytes:
+        """Registro fictício datado de 30 dias atrás, removido na próxima limpeza"""
+        dummy_time = (datetime.now(self.timezone) - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+        return _DUMMY_ROW_PREFIX + dummy_time.encode() + _DUMMY_ROW_SUFFIX
     
     def add_conversion(self, src: str, gclid: str, conversion_time: str, 
                       conversion_value: Optional[float] = None,
-                      order_id: Optional[str] = None) -> bool:
+                      order_id: Optional[str] = None) -> Tuple[bool, Dict[str, int], str]:
         """
         Add a conversion to the CSV file
+        The account's counts and CSV URL are returned from the same call, so
+        the postback handler needs no further lookups
         
         Args:
             src: Source/Account ID
@@ -139,75 +595,158 @@ class CSVHandler:
             order_id: Optional order ID
             
         Returns:
-            True if successful, False otherwise
+            Tuple of (success, counts dict like get_conversion_count, CSV URL)
         """
         # Parse and format conversion time
         try:
-            dt = datetime.fromisoformat(conversion_time.replace('Z', '+00:00'))
+            # C parser, accepts the 'Z' suffix directly
+            dt = ciso8601.parse_datetime(conversion_time)
             # Convert to configured timezone
             dt_local = dt.astimezone(self.timezone)
             # Google Ads requires format: yyyy-MM-dd HH:mm:ss (with timezone in Parameters)
             formatted_time = dt_local.strftime('%Y-%m-%d %H:%M:%S')
         except Exception as e:
-            print(f"Error parsing datetime: {e}")
+            logger.warning("Error parsing datetime: %s", e)
             # Use current time as fallback
             dt_local = datetime.now(self.timezone)
             formatted_time = dt_local.strftime('%Y-%m-%d %H:%M:%S')
         
-        # Get existing CSV or create new one
-        existing_csv = self.storage.get_csv(src)
-        
-        if existing_csv:
-            # Append to existing CSV
-            lines = existing_csv.strip().split('\n')
-            # Remove Parameters:TimeZone if present, keep only header and data
-            header_lines = [line for line in lines if line.startswith('Google Click ID')]
-            data_lines = [line for line in lines if not line.startswith('Parameters:') and not line.startswith('Google Click ID') and line.strip()]
-            value = str(conversion_value) if conversion_value is not None else ""
-            order_id_value = order_id if order_id else ""
-            new_row = f"{gclid},{settings.CONVERSION_NAME},{formatted_time},{value},{settings.CURRENCY},{order_id_value}"
-            csv_content = '\n'.join(header_lines) + '\n' + '\n'.join(data_lines + [new_row])
-        else:
-            # Create new CSV with header
-            csv_content = self._create_new_csv(gclid, formatted_time, conversion_value, order_id)
+        value = str(conversion_value) if conversion_value is not None else ""
+        new_row = _format_row([gclid, settings.CONVERSION_NAME, formatted_time, value, settings.CURRENCY, order_id or ""])
         
-        # Save to R2
-        return self.storage.save_csv(src, csv_content)
+        # Append in memory, the cache flushes to R2 in the background
+        with self.cache.lock(src):
+            try:
+                entry = self.cache.get(src)
+            except Exception as e:
+                # Appending to an empty entry would overwrite the CSV on flush
+                logger.error("Error loading CSV for %s, conversion not saved: %s", src, e)
+                return False, {}, self.get_csv_url(src)
+            if not entry['header']:
+                entry['header'] = HEADER
+            entry['rows'].append(new_row)
+            self.cache.mark_dirty(src)
+            recent_count = len(entry['rows'])
+        
+        history_count = self._get_history_count(src)
+        counts = {
+            'recent': recent_count,
+            'history': history_count,
+            'total': recent_count + history_count
+        }
+        return True, counts, self.get_csv_url(src)
     
-    def _create_new_csv(self, gclid: str, formatted_time: str, 
-                       conversion_value: Optional[float] = None,
-                       order_id: Optional[str] = None) -> str:
+    def flush(self) -> bool:
         """
-        Create a new CSV with header and first row
-        Following Google Ads official format specification
+        Write all pending conversions to R2
+        Must be called before shutdown to avoid losing buffered rows
+        
+        Returns:
+            True if successful, False otherwise
+        """
+        return self.cache.flush_all()
+    
+    def iter_csv_content(self, src: str) -> Optional[Iterator[bytes]]:
+        """
+        Get CSV content for a source/account ID as an iterator of chunks
+        Rows are snapshotted under the lock and serialized while streaming,
+        so the full CSV is never built as a single string
         
         Args:
-            gclid: Google Click ID
-            formatted_time: Formatted datetime string (yyyy-MM-dd HH:mm:ss)
-            conversion_value: Optional conversion value
-            order_id: Optional order ID
+            src: Source/Account ID
             
         Returns:
-            CSV content as string
+            Iterator of CSV chunks, or None if not found
         """
-        # Header with Order ID (Google Ads format)
-        header = "Google Click ID,Conversion Name,Conversion Time,Conversion Value,Conversion Currency,Order ID\n"
-        value = str(conversion_value) if conversion_value is not None else ""
-        order_id_value = order_id if order_id else ""
-        row = f"{gclid},{settings.CONVERSION_NAME},{formatted_time},{value},{settings.CURRENCY},{order_id_value}"
-        return header + row
+        if not self._exists(src):
+            return None
+        with self.cache.lock(src):
+            entry = self.cache.get(src)
+            if not entry['exists']:
+                return None
+            header, rows = entry['header'], list(entry['rows'])
+        return self.cache.render_chunks(header, rows)
+    
+    def stat_csv(self, src: str) -> Optional[Dict]:
+        """
+        Get HTTP cache validators for a source's CSV without rendering it
+        Must be read before the content, so the tag never claims a newer revision
+        
+        Args:
+            src: Source/Account ID
+            
+        Returns:
+            Dict with 'etag' and 'last_modified' (epoch seconds), or None if not found
+        """
+        if not self._exists(src):
+            return None
+        with self.cache.lock(src):
+            entry = self.cache.get(src)
+            if not entry['exists']:
+                return None
+            return {
+                'etag': f'W/"{self.cache.boot_id}-{entry["revision"]:x}"',
+                'last_modified': entry['modified']
+            }
+    
+    def _exists(self, src: str) -> bool:
+        """
+        Check whether src has a CSV, in memory or in R2
+        Unknown srcs from public URLs are checked with a HEAD request, so they
+        never get a cache entry or lock
+        
+        Raises:
+            ClientError: If R2 couldn't be queried
+        """
+        entry = self.cache.peek(src)
+        if entry is not None:
+            return entry['exists']
+        return self.storage.head_csv(src) is not None
+    
+    def stat_history(self, src: str) -> Optional[Dict]:
+        """
+        Get HTTP cache validators for a source's history CSV with a HEAD request
+        
+        Args:
+            src: Source/Account ID
+            
+        Returns:
+            Dict with 'etag', 'last_modified' (epoch seconds) and 'gzip' (stored
+            as a single gzip member, servable as-is), or None if not found
+            
+        Raises:
+            ClientError: If R2 couldn't be queried
+        """
+        try:
+            head = self.storage.head_csv(f"{src}_history")
+        except Exception as e:
+            logger.error("Error reading metadata for %s_history: %s", src, e)
+            raise
+        if head is None:
+            return None
+        # Weak: the R2 ETag is for the gzip object, the response is decompressed
+        return {
+            'etag': f"W/{head['ETag']}",
+            'last_modified': head['LastModified'].timestamp(),
+            'gzip': head.get('ContentEncoding') == 'gzip' and 'multimember' not in head.get('Metadata', {})
+        }
     
-    def get_csv_content(self, src: str) -> Optional[str]:
+    def iter_history_content(self, src: str, decompress: bool = True) -> Optional[Iterator[bytes]]:
         """
-        Get CSV content for a source/account ID
+        Get history CSV content for a source/account ID as an iterator of chunks
+        History is only written by cleanup, so it is streamed straight from R2
         
         Args:
             src: Source/Account ID
+            decompress: False to stream the stored gzip bytes unchanged
             
         Returns:
-            CSV content as string, or None if not found
+            Iterator of CSV chunks, or None if not found
+            
+        Raises:
+            Exception: If R2 couldn't be read
         """
-        return self.storage.get_csv(src)
+        return self.storage.iter_csv_bytes(f"{src}_history", decompress=decompress)
     
     def get_csv_url(self, src: str) -> str:
         """
@@ -221,55 +760,126 @@ class CSVHandler:
         """
         return self.storage.get_public_url(src)
     
-    def get_all_sources(self) -> List[str]:
+    def get_all_sources(self, include_history: bool = False) -> Tuple[str, ...]:
+        """
+        Get all customer IDs that have CSV files
+        The R2 listing is cached for a few seconds and merged with accounts
+        whose first rows are still only in memory. The sorted result is reused
+        until either of those changes
+        
+        Args:
+            include_history: Also return '{src}_history' names (default: False)
+        
+        Returns:
+            Sorted tuple of customer IDs
+        """
+        listed = self._get_listing()
+        known = self.cache.known_sources()
+        snapshot = self._sources_snapshot.get(include_history)
+        if snapshot is not None and snapshot[0] is listed and snapshot[1] is known:
+            return snapshot[2]
+        
+        names = listed or []
+        if not include_history:
+            names = [name for name in names if not name.endswith('_history')]
+        sources = tuple(sorted(known.union(names)))
+        self._sources_snapshot[include_history] = (listed, known, sources)
+        return sources
+    
+    def _get_listing(self) -> Optional[List[str]]:
+        """Return the cached R2 listing, refreshing it once the TTL expires"""
+        with self._sources_lock:
+            listed = self._sources_cache.get('sources')
+            if listed is None:
+                listed = self._list_sources()
+                if listed is not None:
+                    self._sources_cache['sources'] = listed
+            return listed
+    
+    def _list_sources(self) -> Optional[List[str]]:
         """
-        Get list of all customer IDs that have CSV files
+        List CSV names (without extension) from R2, history files included,
+        following pagination past 1000 objects
         
         Returns:
-            List of customer IDs
+            List of CSV names, or None if listing failed
         """
         try:
-            response = self.storage.s3_client.list_objects_v2(Bucket=self.storage.bucket_name)
-            if 'Contents' not in response:
-                return []
-            
-            srcs = []
-            for obj in response['Contents']:
-                key = obj['Key']
-                if key.endswith('.csv'):
-                    src = key.replace('.csv', '')
-                    srcs.append(src)
-            return sorted(srcs)
+            paginator = self.storage.s3_client.get_paginator('list_objects_v2')
+            names = []
+            for page in paginator.paginate(Bucket=self.storage.bucket_name):
+                for obj in page.get('Contents', []):
+                    key = obj['Key']
+                    if key.endswith('.csv'):
+                        names.append(key[:-len('.csv')])
+            return names
         except Exception as e:
-            print(f"Error listing customer IDs: {e}")
-            return []
+            logger.error("Error listing customer IDs: %s", e)
+            return None
+    
+    def get_all_counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get conversion counts for every customer ID in one call
+        A single R2 listing tells which accounts have a history file, so only
+        those need a HEAD request; accounts are counted in parallel
+        
+        Returns:
+            Dict mapping src to its 'recent', 'history' and 'total' counts, ordered by src
+        """
+        sources = self.get_all_sources()
+        if not sources:
+            return {}
+        
+        listed = self._get_listing()
+        # Without a listing every history has to be checked
+        histories = None if listed is None else {name for name in listed if name.endswith('_history')}
+        
+        def count(src: str) -> Dict[str, int]:
+            has_history = None if histories is None else f"{src}_history" in histories
+            return self.get_conversion_count(src, has_history)
+        
+        with ThreadPoolExecutor(max_workers=min(COUNT_WORKERS, len(sources))) as executor:
+            return dict(zip(sources, executor.map(count, sources)))
+    
+    def get_all_stats(self) -> List[Tuple[str, Dict[str, int], str, str]]:
+        """
+        Get counts and CSV URLs for every customer ID in one call
+        
+        Returns:
+            List of (src, counts, csv_url, history_url) tuples ordered by src
+        """
+        return [
+            (src, counts, f"{self.url_prefix}/{src}.csv", f"{self.url_prefix}/{src}_history.csv")
+            for src, counts in self.get_all_counts().items()
+        ]
     
-    def get_conversion_count(self, src: str) -> Dict[str, int]:
+    def get_conversion_count(self, src: str, has_history: Optional[bool] = None) -> Dict[str, int]:
         """
         Get number of conversions for a customer ID
         Returns separate counts for recent and archived conversions
         
         Args:
             src: Customer ID
+            has_history: Whether a history file exists, if already known
             
         Returns:
             Dict with 'recent', 'history', and 'total' counts
         """
-        # Count recent conversions
-        recent_csv = self.storage.get_csv(src)
-        recent_count = 0
-        if recent_csv:
-            lines = recent_csv.strip().split('\n')
-            data_lines = [line for line in lines if not line.startswith('Parameters:') and not line.startswith('Google Click ID') and line.strip()]
-            recent_count = len(data_lines)
-        
-        # Count archived conversions
-        history_csv = self.storage.get_csv(f"{src}_history")
-        history_count = 0
-        if history_csv:
-            lines = history_csv.strip().split('\n')
-            data_lines = [line for line in lines if not line.startswith('Parameters:') and not line.startswith('Google Click ID') and line.strip()]
-            history_count = len(data_lines)
+        # Count recent conversions, from memory when the account is cached
+        with self.cache.lock(src):
+            entry = self.cache.peek(src)
+            if entry is not None:
+                recent_count = len(entry['rows'])
+            else:
+                recent_count = self.storage.get_row_count(src)
+                if recent_count is None:
+                    try:
+                        recent_count = len(self.cache.get(src)['rows'])
+                    except Exception:
+                        # Display only, the next call retries the load
+                        recent_count = 0
+        
+        history_count = self._get_history_count(src, has_history)
         
         return {
             'recent': recent_count,
@@ -277,87 +887,119 @@ class CSVHandler:
             'total': recent_count + history_count
         }
     
+    def _get_history_count(self, src: str, has_history: Optional[bool] = None) -> int:
+        """
+        Count archived conversions, kept in memory after the first lookup
+        History only changes through _append_to_history, which drops the
+        cached count under the same lock
+        """
+        # Hits skip the lock, which cleanup holds while the history is written
+        history_count = self._history_counts.get(src)
+        if history_count is not None:
+            return history_count
+        
+        with self.cache.lock(f"{src}_history"):
+            history_count = self._history_counts.get(src)
+            if history_count is not None:
+                return history_count
+            
+            if has_history is False:
+                # The listing may predate a history created since; only counts
+                # read from R2 under this lock are remembered
+                return 0
+            
+            # Download only files without metadata
+            history_count = self.storage.get_row_count(f"{src}_history")
+            if history_count is not None:
+                self._history_counts[src] = history_count
+                return history_count
+            
+            try:
+                history_csv = self.storage.get_csv_bytes(f"{src}_history")
+            except Exception:
+                history_csv = None
+            if history_csv is None:
+                # Missing or unreadable, don't remember a guess
+                return 0
+            lines = history_csv.strip().split(b'\n')
+            history_count = self._history_counts[src] = sum(1 for line in lines if not _SKIP_LINE_RE.match(line))
+            return history_count
+    
     def cleanup_old_conversions(self, src: str, hours: int = 25) -> Dict[str, int]:
         """
         Archive conversions older than specified hours
+        Rows are appended to the history first and only removed from the CSV
+        once that write succeeded, so a failed archive loses nothing
         
         Args:
             src: Customer ID
             hours: Number of hours (default: 25)
             
         Returns:
-            Dict with 'archived' and 'remaining' counts
+            Dict with 'archived', 'remaining' and 'failed' (rows that couldn't
+            be archived and were kept in the CSV) counts
         """
-        csv_content = self.storage.get_csv(src)
-        if not csv_content:
-            return {'archived': 0, 'remaining': 0}
-        
-        cutoff_time = datetime.now(self.timezone) - timedelta(hours=hours)
-        
-        lines = csv_content.strip().split('\n')
-        header_line = None
-        recent_rows = []
-        old_rows = []
-        
-        for line in lines:
-            # Keep header
-            if line.startswith('Google Click ID'):
-                header_line = line
-                continue
+        # Held throughout so concurrent cleanups can't archive the same rows twice;
+        # postbacks only take it when the history count isn't cached
+        with self.cache.lock(f"{src}_history"):
+            with self.cache.lock(src):
+                try:
+                    entry = self.cache.get(src)
+                except Exception as e:
+                    logger.error("Erro ao carregar CSV de %s, limpeza ignorada: %s", src, e)
+                    return {'archived': 0, 'remaining': 0, 'failed': 0}
+                if not entry['exists']:
+                    return {'archived': 0, 'remaining': 0, 'failed': 0}
+                
+                # Conversion Time is stored as yyyy-MM-dd HH:mm:ss in the configured
+                # timezone, so plain string comparison orders rows chronologically
+                cutoff = (datetime.now(self.timezone) - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S').encode()
+                
+                old_rows = []
+                
+                for line in entry['rows']:
+                    if b'"' in line:
+                        parts = [field.encode('utf-8') for field in next(csv.reader([line.decode('utf-8')]))]
+                    else:
+                        parts = line.split(b',', 3)
+                    # Malformed rows stay in recent to be safe
+                    if len(parts) >= 3 and _CONVERSION_TIME_RE.fullmatch(parts[2]) and parts[2] < cutoff:
+                        old_rows.append(line)
             
-            # Skip parameter lines and empty lines
-            if line.startswith('Parameters:') or not line.strip():
-                continue
+            # Append old conversions to history, outside lock(src) so postbacks
+            # keep flowing while it is written
+            if old_rows and not self._append_to_history(src, old_rows):
+                with self.cache.lock(src):
+                    remaining = len(entry['rows'])
+                logger.error("❌ Falha ao arquivar %s conversões de %s, mantidas no CSV", len(old_rows), src)
+                return {'archived': 0, 'remaining': remaining, 'failed': len(old_rows)}
             
-            # Parse conversion time from CSV row
-            try:
-                parts = line.split(',')
-                if len(parts) >= 3:
-                    conversion_time_str = parts[2]  # Conversion Time is 3rd column
-                    # Parse datetime (format: yyyy-MM-dd HH:mm:ss)
-                    conversion_time = datetime.strptime(conversion_time_str, '%Y-%m-%d %H:%M:%S')
-                    # Make timezone aware
-                    conversion_time = self.timezone.localize(conversion_time)
-                    
-                    if conversion_time < cutoff_time:
-                        old_rows.append(line)
-                    else:
-                        recent_rows.append(line)
-                else:
-                    # Malformed row, keep it in recent to be safe
-                    recent_rows.append(line)
-            except Exception as e:
-                print(f"Error parsing conversion time: {e}, keeping row in recent")
-                recent_rows.append(line)
-        
-        # Save recent conversions back to main CSV
-        # Se não sobrou nenhum registro recente, adiciona um registro fictício
-        # para evitar que o CSV fique vazio (Google Ads não aceita CSV vazio)
-        if not recent_rows:
-            dummy_time = (datetime.now(self.timezone) - timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
-            dummy_row = f"EAIaIQobChMIs6mly9qAkgMV5EFIAB1kbDikEAAYASAAEgK-M_D_BwE,{settings.CONVERSION_NAME},{dummy_time},1074.36,{settings.CURRENCY},44867721"
-            recent_rows = [dummy_row]
-            print(f"⚠️ Nenhum registro recente para {src}, adicionando registro fictício")
-        
-        if header_line:
-            recent_csv = header_line + '\n' + '\n'.join(recent_rows)
-        else:
-            recent_csv = '\n'.join(recent_rows)
+            with self.cache.lock(src):
+                # Rows added since the scan are newer than the cutoff and stay
+                archived = set(old_rows)
+                recent_rows = [line for line in entry['rows'] if line not in archived]
+                
+                # Save recent conversions back to main CSV
+                # Se não sobrou nenhum registro recente, adiciona um registro fictício
+                # para evitar que o CSV fique vazio (Google Ads não aceita CSV vazio)
+                if not recent_rows:
+                    recent_rows = [self._dummy_row()]
+                    logger.info("⚠️ Nenhum registro recente para %s, adicionando registro fictício", src)
+                
+                if recent_rows != entry['rows']:
+                    entry['rows'] = recent_rows
+                    self.cache.mark_dirty(src)
+        self.cache.flush(src)
         
-        self.storage.save_csv(src, recent_csv)
-        
-        # Append old conversions to history
-        if old_rows:
-            self._append_to_history(src, old_rows)
-        
-        print(f"🧹 Cleanup for {src}: {len(old_rows)} archived, {len(recent_rows)} remaining")
+        logger.info("🧹 Cleanup for %s: %s archived, %s remaining", src, len(old_rows), len(recent_rows))
         
         return {
             'archived': len(old_rows),
-            'remaining': len(recent_rows)
+            'remaining': len(recent_rows),
+            'failed': 0
         }
     
-    def _append_to_history(self, src: str, rows: List[str]) -> bool:
+    def _append_to_history(self, src: str, rows: List[bytes]) -> bool:
         """
         Append conversion rows to history CSV
         
@@ -368,18 +1010,60 @@ class CSVHandler:
         Returns:
             True if successful
         """
+        # Same lock as _get_history_count, so a count read during the write
+        # can't be cached after it
+        with self.cache.lock(f"{src}_history"):
+            saved = self._write_history(src, rows)
+            self._history_counts.pop(src, None)
+        return saved
+    
+    def _write_history(self, src: str, rows: List[bytes]) -> bool:
+        """Write rows to the history CSV, server-side for large histories"""
         history_key = f"{src}_history"
-        existing_history = self.storage.get_csv(history_key)
+        
+        # Large histories are extended server-side instead of downloaded
+        try:
+            head = self.storage.head_csv(history_key)
+        except Exception as e:
+            logger.error("Error reading metadata for %s: %s", history_key, e)
+            head = None
+        if (head and head.get('ContentLength', 0) >= MULTIPART_MIN_PART_SIZE
+                and head.get('ContentEncoding') == 'gzip'
+                and 'rowcount' in head.get('Metadata', {})):
+            row_count = int(head['Metadata']['rowcount']) + len(rows)
+            if self.storage.append_csv(history_key, b'\n' + b'\n'.join(rows), row_count):
+                return True
+            # A changed object means the upload completed and only its response was lost
+            try:
+                after = self.storage.head_csv(history_key)
+            except Exception:
+                after = head
+            if after is not None and after.get('ETag') != head.get('ETag'):
+                return True
+            logger.warning("⚠️ Append multipart falhou para %s, regravando o histórico inteiro", history_key)
+        
+        try:
+            existing_history = self.storage.get_csv_bytes(history_key)
+        except Exception:
+            # Saving now would replace the unread history with these rows only
+            return False
         
         if existing_history:
-            # Append to existing history
-            updated_history = existing_history.strip() + '\n' + '\n'.join(rows)
+            # Append to existing history; older files have a blank line after
+            # the header, which is dropped so it isn't counted as a row
+            lines = [line for line in existing_history.strip().split(b'\n') if line.strip()]
         else:
             # Create new history file with header
-            header = "Google Click ID,Conversion Name,Conversion Time,Conversion Value,Conversion Currency,Order ID\n"
-            updated_history = header + '\n' + '\n'.join(rows)
+            lines = [HEADER]
+        row_count = sum(1 for line in lines if not _SKIP_LINE_RE.match(line)) + len(rows)
+        updated_history = b'\n'.join(lines + rows)
         
-        return self.storage.save_csv(history_key, updated_history)
+        saved = self.storage.save_csv(history_key, updated_history, row_count)
+        if saved and not existing_history:
+            # The cached listing doesn't know about the new file yet
+            with self._sources_lock:
+                self._sources_cache.clear()
+        return saved
     
     def cleanup_all_sources(self, hours: int = 25) -> Dict[str, Dict[str, int]]:
         """
@@ -393,12 +1077,11 @@ class CSVHandler:
             Dict mapping src to cleanup results
         """
         sources = self.get_all_sources()
-        results = {}
-        
-        for src in sources:
-            # Skip history files
-            if src.endswith('_history'):
-                continue
-            results[src] = self.cleanup_old_conversions(src, hours)
+        if not sources:
+            return {}
         
-        return results
+        # Accounts are independent, so run them in parallel; each worker holds
+        # one R2 connection at a time, which keeps us within the client pool
+        with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(sources))) as executor:
+            results = executor.map(lambda src: self.cleanup_old_conversions(src, hours), sources)
+            return dict(zip(sources, results))
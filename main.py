@@ -3,40 +3,77 @@
 FastAPI application for Google Ads Offline Conversions
 """
 from fastapi import FastAPI, HTTPException, Query, Request, Depends, Form
-from fastapi.responses import Response, HTMLResponse
+from fastapi.responses import Response, HTMLResponse, StreamingResponse, ORJSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
-from datetime import datetime
-from typing import Optional
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Annotated, AsyncIterator, Callable, Dict, Iterator, Optional
+import anyio
+import asyncio
+import functools
+import hmac
+import logging
+import queue
+import sys
+import time
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+import jinja2
+import orjson
 import uvicorn
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-import pytz
+from zoneinfo import ZoneInfo
+
+from cachetools import TTLCache
 
 from config import settings
 from models import PostbackRequest, ConversionResponse, CleanupResponse
 from csv_handler import CSVHandler
 from auth import authenticate_dashboard, get_security_stats
 
-# Initialize FastAPI app
-app = FastAPI(
-    title=settings.APP_NAME,
-    description="Sistema para receber postbacks e gerar CSVs para Google Ads",
-    version="1.0.0"
-)
+# Handlers only enqueue log records; a background thread writes them to stdout,
+# so logging never blocks the event loop on a write() syscall
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+log = logging.getLogger("clickfast")
+log.addHandler(QueueHandler(_log_queue))
+log.setLevel(settings.LOG_LEVEL)
+log.propagate = False
 
-# Initialize templates
-templates = Jinja2Templates(directory="templates")
+ANYIO_THREAD_TOKENS = 200
+
+# API key as bytes, encoded once for constant-time comparison
+_API_KEY_B = settings.API_KEY.encode()
 
 # Initialize CSV handler
 csv_handler = CSVHandler()
 
-# Initialize scheduler
-scheduler = BackgroundScheduler(timezone=pytz.timezone('America/Sao_Paulo'))
+# Dashboard stats and rendered HTML, keyed by the data version they were built
+# from; a new conversion changes the version, the TTL bounds staleness otherwise
+_dashboard_stats: TTLCache = TTLCache(maxsize=1, ttl=settings.DASHBOARD_CACHE_TTL)
+_dashboard_cache: TTLCache = TTLCache(maxsize=16, ttl=settings.DASHBOARD_CACHE_TTL)
+
+# Initialize scheduler; it runs jobs on the app's event loop, no extra thread
+scheduler = AsyncIOScheduler(timezone=ZoneInfo('America/Sao_Paulo'))
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Start scheduler when application starts"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start log writer, I/O pool and scheduler; flush and stop them on shutdown"""
+    _log_listener.start()
+    # Dedicated pool for blocking R2 calls, kept within the boto3 connection pool
+    app.state.io_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="r2-io")
+    # Starlette's threadpool runs sync dependencies (dashboard auth pads failed
+    # logins with a sleep) and iterates streamed CSVs; the default 40 threads
+    # would queue them behind each other under concurrent load
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ANYIO_THREAD_TOKENS
+    # Compile the dashboard template now rather than on the first request
+    templates.get_template("index.html")
+    
     # Execute cleanup every day at 12:30 (GMT-03:00)
     scheduler.add_job(
         run_cleanup,
@@ -46,162 +83,212 @@ async def startup_event():
         replace_existing=True
     )
     scheduler.start()
-    print("✅ Scheduler iniciado - Limpeza automática configurada para 12:30 (GMT-03:00)")
+    log.info("✅ Scheduler iniciado - Limpeza automática configurada para 12:30 (GMT-03:00)")
+    
+    yield
+    
+    if not await run_io(csv_handler.flush):
+        log.error("❌ Erro ao gravar conversões pendentes no R2")
+    scheduler.shutdown()
+    log.info("🛑 Scheduler encerrado")
+    app.state.io_pool.shutdown()
+    _log_listener.stop()
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Stop scheduler when application shuts down"""
-    scheduler.shutdown()
-    print("🛑 Scheduler encerrado")
+# Initialize FastAPI app
+app = FastAPI(
+    title=settings.APP_NAME,
+    description="Sistema para receber postbacks e gerar CSVs para Google Ads",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
+
+# CSVs and dashboard HTML are repetitive text and shrink several times over;
+# tiny JSON replies are left alone
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+# Initialize templates: compiled bytecode survives restarts, and outside DEBUG
+# templates are not re-checked on disk for every render
+templates = Jinja2Templates(env=jinja2.Environment(
+    loader=jinja2.FileSystemLoader("templates"),
+    autoescape=True,
+    auto_reload=settings.DEBUG,
+    bytecode_cache=jinja2.FileSystemBytecodeCache(),
+    cache_size=400
+))
+
 
+async def run_io(fn: Callable, *args, **kwargs):
+    """Run a blocking csv_handler call in the I/O pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app.state.io_pool, functools.partial(fn, *args, **kwargs))
 
-def run_cleanup():
+
+async def run_cleanup():
     """Function executed by scheduler for automatic cleanup"""
-    print(f"🧹 Iniciando limpeza automática - {datetime.now()}")
+    log.info("🧹 Iniciando limpeza automática")
     try:
-        results = csv_handler.cleanup_all_sources(hours=25)
+        results = await run_io(csv_handler.cleanup_all_sources, hours=25)
         
         total_archived = sum(r['archived'] for r in results.values())
         total_remaining = sum(r['remaining'] for r in results.values())
+        total_failed = sum(r['failed'] for r in results.values())
         
-        print(f"✅ Limpeza concluída - Arquivadas: {total_archived}, Restantes: {total_remaining}")
-        print(f"📊 Detalhes: {results}")
+        log.info("✅ Limpeza concluída - Arquivadas: %s, Restantes: %s", total_archived, total_remaining)
+        if total_failed:
+            log.error("❌ %s conversões não puderam ser arquivadas e continuam nos CSVs", total_failed)
+        log.debug("📊 Detalhes: %s", results)
     except Exception as e:
-        print(f"❌ Erro na limpeza automática: {e}")
+        log.error("❌ Erro na limpeza automática: %s", e)
+
+
+async def _get_dashboard_stats() -> Dict:
+    """
+    Get per-account stats and totals for the dashboard, user-agnostic
+    Reused while the conversion data version is unchanged and the TTL holds
+    
+    Returns:
+        Dict with 'stats' list and 'total_*' counts
+    """
+    # Read the version first: data changing mid-build leaves a stale key behind
+    version = csv_handler.version
+    cached = _dashboard_stats.get(version)
+    if cached is not None:
+        return cached
+    
+    # Get counts and URLs for all customer IDs in one call
+    stats = [
+        {
+            'src': src,
+            'recent_count': counts['recent'],
+            'history_count': counts['history'],
+            'total_count': counts['total'],
+            'csv_url': csv_url,
+            'history_url': history_url
+        }
+        for src, counts, csv_url, history_url in await run_io(csv_handler.get_all_stats)
+    ]
+    total_recent = sum(stat['recent_count'] for stat in stats)
+    total_history = sum(stat['history_count'] for stat in stats)
+    total_conversions = total_recent + total_history
+    
+    # Returned from the local: with a zero TTL the entry expires before it can be read back
+    result = _dashboard_stats[version] = {
+        "total_conversions": total_conversions,
+        "total_recent": total_recent,
+        "total_history": total_history,
+        "total_accounts": len(stats),
+        "stats": stats
+    }
+    return result
+
+
+async def _build_dashboard_context(request: Request, username: str, add_source_msg: Optional[str] = None) -> Dict:
+    """
+    Build the index.html template context shared by dashboard and add_source
+    
+    Args:
+        request: FastAPI request object
+        username: Authenticated dashboard user
+        add_source_msg: Optional feedback message from add_source
+        
+    Returns:
+        Template context dict
+    """
+    return {
+        "request": request,
+        **await _get_dashboard_stats(),
+        "app_name": settings.APP_NAME,
+        "authenticated_user": username,
+        "add_source_msg": add_source_msg
+    }
 
 
 @app.get("/", response_class=HTMLResponse)
 async def dashboard(request: Request, username: str = Depends(authenticate_dashboard)):
     """Dashboard de monitoramento com autenticação segura"""
     try:
-        # Get all customer IDs
-        sources = csv_handler.get_all_sources()
-        
-        # Get conversion counts
-        stats = []
-        total_conversions = 0
-        total_recent = 0
-        total_history = 0
+        # Serve the last render while it is fresh and no conversion data changed
+        key = (username, csv_handler.version)
+        cached = _dashboard_cache.get(key)
+        if cached is not None:
+            return HTMLResponse(cached)
         
-        for src in sources:
-            # Skip history files
-            if src.endswith('_history'):
-                continue
-                
-            counts = csv_handler.get_conversion_count(src)
-            total_conversions += counts['total']
-            total_recent += counts['recent']
-            total_history += counts['history']
-            csv_url = csv_handler.get_csv_url(src)
-            history_url = csv_handler.get_csv_url(f"{src}_history")
-            stats.append({
-                'src': src,
-                'recent_count': counts['recent'],
-                'history_count': counts['history'],
-                'total_count': counts['total'],
-                'csv_url': csv_url,
-                'history_url': history_url
-            })
-         
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "total_conversions": total_conversions,
-                "total_recent": total_recent,
-                "total_history": total_history,
-                "total_accounts": len(stats),
-                "stats": stats,
-                "app_name": settings.APP_NAME,
-                "authenticated_user": username
-            }
-        )
+        response = templates.TemplateResponse("index.html", await _build_dashboard_context(request, username))
+        _dashboard_cache[key] = response.body
+        return response
     except Exception as e:
-        print(f"❌ Error loading dashboard: {e}")
+        log.error("❌ Error loading dashboard: %s", e)
         return HTMLResponse(
             content=f"<h1>Error loading dashboard</h1><p>{str(e)}</p>",
             status_code=500
         )
 
 
-@app.post("/add-source")
+@app.post("/add-source", response_class=HTMLResponse)
 async def add_source(request: Request, src: str = Form(...), username: str = Depends(authenticate_dashboard)):
     """Adiciona uma nova conta (src) criando um CSV vazio se não existir."""
     try:
-        created = csv_handler.create_empty_source(src)
+        created = await run_io(csv_handler.create_empty_source, src)
         if created:
             msg = f"Conta '{src}' adicionada com sucesso."
         else:
             msg = f"Erro ao adicionar conta '{src}'."
         
         # Recarrega dashboard com mensagem
-        sources = csv_handler.get_all_sources()
-        stats = []
-        total_conversions = 0
-        total_recent = 0
-        total_history = 0
-        
-        for s in sources:
-            # Skip history files
-            if s.endswith('_history'):
-                continue
-                
-            counts = csv_handler.get_conversion_count(s)
-            total_conversions += counts['total']
-            total_recent += counts['recent']
-            total_history += counts['history']
-            csv_url = csv_handler.get_csv_url(s)
-            history_url = csv_handler.get_csv_url(f"{s}_history")
-            stats.append({
-                'src': s,
-                'recent_count': counts['recent'],
-                'history_count': counts['history'],
-                'total_count': counts['total'],
-                'csv_url': csv_url,
-                'history_url': history_url
-            })
-        
-        return templates.TemplateResponse(
-            "index.html",
-            {
-                "request": request,
-                "total_conversions": total_conversions,
-                "total_recent": total_recent,
-                "total_history": total_history,
-                "total_accounts": len(stats),
-                "stats": stats,
-                "app_name": settings.APP_NAME,
-                "authenticated_user": username,
-                "add_source_msg": msg
-            }
-        )
+        return templates.TemplateResponse("index.html", await _build_dashboard_context(request, username, msg))
     except Exception as e:
-        print(f"❌ Erro ao adicionar conta: {e}")
+        log.error("❌ Erro ao adicionar conta: %s", e)
         return HTMLResponse(
             content=f"<h1>Erro ao adicionar conta</h1><p>{str(e)}</p>",
             status_code=500
         )
 
 
-@app.get("/postback")
-@app.post("/postback")
-async def receive_postback(
-    gclid: str = Query(..., description="Google Click ID"),
-    src: str = Query(..., description="Source/Account ID"),
-    orderId: Optional[str] = Query(None),
-    commission: Optional[float] = Query(None),
-    productName: Optional[str] = Query(None),
-    productId: Optional[str] = Query(None),
-    dateTime: Optional[str] = Query(None),
-    utmSource: Optional[str] = Query(None),
-    utmCampaign: Optional[str] = Query(None),
-    utmMedium: Optional[str] = Query(None),
-    utmContent: Optional[str] = Query(None),
-    utmTerm: Optional[str] = Query(None),
-    upsellNo: Optional[int] = Query(None),
-):
+# (second, ISO string) for the current UTC time, rebuilt when the second ticks;
+# a tuple so concurrent readers always see a matching pair
+_cached_ts = (0, "")
+
+
+def _utc_now_iso() -> str:
+    """Return the current UTC time as ISO 8601 with 'Z', cached per second"""
+    global _cached_ts
+    now = int(time.time())
+    if _cached_ts[0] != now:
+        _cached_ts = (now, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+    return _cached_ts[1]
+
+
+def require_google_source(utmSource: Optional[str] = Query(None)):
+    """
+    Só aceitar vendas vindas do Google
+    Runs as a dependency so rejected traffic never reaches PostbackRequest validation
+    
+    Raises:
+        HTTPException: 400 if utm_source is missing or not 'google'
+    """
+    if not utmSource or utmSource.lower() != 'google':
+        raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_source diferente de 'google'.")
+    # (Opcional) Validar utm_medium e utm_campaign se quiser mais restrição
+    # if not utmMedium or utmMedium.lower() != 'cpc':
+    #     raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_medium diferente de 'cpc'.")
+    # if not utmCampaign:
+    #     raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_campaign não informado.")
+
+
+# ConversionResponse only documents the reply; the handler returns it as a
+# plain dict so FastAPI skips response-model validation
+_POSTBACK_ROUTE = dict(
+    response_class=ORJSONResponse,
+    responses={200: {"model": ConversionResponse}},
+    dependencies=[Depends(require_google_source)]
+)
+
+
+@app.get("/postback", **_POSTBACK_ROUTE)
+@app.post("/postback", **_POSTBACK_ROUTE)
+async def receive_postback(postback: Annotated[PostbackRequest, Query()]):
     """
     Recebe postback de conversão e adiciona ao CSV correspondente
     
@@ -212,78 +299,165 @@ async def receive_postback(
     Parâmetros opcionais:
     - commission: Valor da comissão
     - dateTime: Data/hora da conversão (ISO 8601)
-    - orderId, productName, productId, utmSource, etc.
+    - orderId: ID do pedido
+    - utmSource: precisa ser 'google' (validado por require_google_source)
+    
+    Outros parâmetros de rastreamento são aceitos e ignorados
     """
+    # Use provided datetime or current time
+    conversion_time = postback.dateTime if postback.dateTime else _utc_now_iso()
+    
+    # Add conversion to CSV, getting counts and URL from the same call
     try:
-        # Validate request using Pydantic model
-        postback = PostbackRequest(
-            gclid=gclid,
-            src=src,
-            orderId=orderId,
-            commission=commission,
-            productName=productName,
-            productId=productId,
-            dateTime=dateTime,
-            utmSource=utmSource,
-            utmCampaign=utmCampaign,
-            utmMedium=utmMedium,
-            utmContent=utmContent,
-            utmTerm=utmTerm,
-            upsellNo=upsellNo
-        )
-
-        # Só aceitar vendas vindas do Google
-        if not postback.utmSource or postback.utmSource.lower() != 'google':
-            raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_source diferente de 'google'.")
-        # (Opcional) Validar utm_medium e utm_campaign se quiser mais restrição
-        # if not postback.utmMedium or postback.utmMedium.lower() != 'cpc':
-        #     raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_medium diferente de 'cpc'.")
-        # if not postback.utmCampaign:
-        #     raise HTTPException(status_code=400, detail="Conversão rejeitada: utm_campaign não informado.")
-
-        # Use provided datetime or current time
-        conversion_time = postback.dateTime if postback.dateTime else datetime.utcnow().isoformat()
-
-        # Add conversion to CSV
-        success = csv_handler.add_conversion(
+        success, counts, csv_url = await run_io(
+            csv_handler.add_conversion,
             src=postback.src,
             gclid=postback.gclid,
             conversion_time=conversion_time,
             conversion_value=postback.commission,
             order_id=postback.orderId
         )
-        
-        if not success:
-            raise HTTPException(status_code=500, detail="Erro ao salvar conversão")
-        
-        # Get CSV URL
-        csv_url = csv_handler.get_csv_url(postback.src)
-        
-        # Log success
-        print(f"✅ Conversão recebida - SRC: {postback.src}, GCLID: {postback.gclid}, Valor: {postback.commission}")
-        
-        # Get conversion counts
-        counts = csv_handler.get_conversion_count(postback.src)
-        
-        return ConversionResponse(
-            success=True,
-            message=f"Conversão registrada com sucesso! Total de conversões para conta {postback.src}: {counts['total']}",
-            src=postback.src,
-            gclid=postback.gclid,
-            csv_url=csv_url
-        )
-        
-    except ValueError as e:
-        print(f"❌ Erro de validação: {e}")
-        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Erro ao processar postback: {e}")
+        log.error("❌ Erro ao processar postback: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+    
+    if not success:
+        raise HTTPException(status_code=500, detail="Erro ao salvar conversão")
+    
+    # Log success
+    log.info("✅ Conversão recebida - SRC: %s, GCLID: %s, Valor: %s", postback.src, postback.gclid, postback.commission)
+    
+    return ORJSONResponse({
+        "success": True,
+        "message": f"Conversão registrada com sucesso! Total de conversões para conta {postback.src}: {counts['total']}",
+        "src": postback.src,
+        "gclid": postback.gclid,
+        "csv_url": csv_url
+    })
 
 
-@app.get("/csv/{api_key}/{src}.csv")
+def _validator_headers(stat: Dict) -> Dict[str, str]:
+    """Build ETag, Last-Modified and Cache-Control headers from a csv_handler stat dict"""
+    return {
+        # Revalidate on every poll instead of heuristic freshness from
+        # Last-Modified; private because the URL carries the API key
+        "Cache-Control": "private, no-cache",
+        "ETag": stat['etag'],
+        "Last-Modified": formatdate(stat['last_modified'], usegmt=True)
+    }
+
+
+def _not_modified(request: Request, stat: Dict) -> bool:
+    """
+    Check whether the client's cached copy is still current
+    If-None-Match takes precedence; If-Modified-Since is only used without it
+    
+    Args:
+        request: FastAPI request object
+        stat: Dict with 'etag' and 'last_modified' from csv_handler
+        
+    Returns:
+        True if a 304 Not Modified can be returned
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as required for GET
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or stat['etag'].removeprefix("W/") in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat['last_modified']) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _not_modified_response(stat: Dict) -> Response:
+    """
+    Build the 304 for a CSV route
+    Both routes may answer gzip-encoded (stored gzip or GZipMiddleware), and a
+    304 must carry the same Vary as the 200 it validates
+    """
+    return Response(status_code=304, headers={"Vary": "Accept-Encoding", **_validator_headers(stat)})
+
+
+async def _iter_in_loop(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yield chunks of an in-memory iterator on the event loop
+    StreamingResponse moves each step of a sync iterator to the threadpool,
+    which only pays off when the iterator blocks on I/O
+    """
+    for chunk in chunks:
+        yield chunk
+
+
+async def verify_api_key(api_key: str, src: str):
+    """
+    Validate the API key in the CSV URL path
+    Async so FastAPI runs it inline instead of in the threadpool
+    
+    Raises:
+        HTTPException: 401 if the API key is invalid
+    """
+    # Wrong-length keys are rejected outright; only the length can leak, not the key
+    key = api_key.encode()
+    if len(key) != len(_API_KEY_B) or not hmac.compare_digest(key, _API_KEY_B):
+        log.warning("❌ Tentativa de acesso não autorizado ao CSV %s com API key inválida", src)
+        raise HTTPException(status_code=401, detail="API Key inválida")
+
+
+@app.get("/csv/{api_key}/{src}_history.csv", dependencies=[Depends(verify_api_key)])
+async def get_history_csv(
+    request: Request,
+    src: str
+):
+    """
+    Return history CSV for a specific account
+    For audit purposes only, not used by Google Ads
+    Registered before get_csv, whose {src}.csv pattern would also match
+    
+    Args:
+        api_key: API key for authentication (in path)
+        src: Source/Account ID
+    
+    Example: /csv/your-api-key/7871141994_history.csv
+    """
+    # HEAD first, so an unchanged history costs no download
+    stat = await run_io(csv_handler.stat_history, src)
+    
+    if stat is None:
+        raise HTTPException(status_code=404, detail=f"Histórico não encontrado para conta {src}")
+    
+    if _not_modified(request, stat):
+        return _not_modified_response(stat)
+    
+    # History is stored gzip-encoded: clients that accept gzip get the stored
+    # bytes as-is, and GZipMiddleware leaves responses with an encoding alone
+    send_gzip = stat['gzip'] and "gzip" in request.headers.get("accept-encoding", "").lower()
+    
+    # Open the history object; the body is read while streaming
+    csv_chunks = await run_io(csv_handler.iter_history_content, src, decompress=not send_gzip)
+    
+    if csv_chunks is None:
+        raise HTTPException(status_code=404, detail=f"Histórico não encontrado para conta {src}")
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename={src}_history.csv",
+        "Vary": "Accept-Encoding",
+        **_validator_headers(stat)
+    }
+    if send_gzip:
+        headers["Content-Encoding"] = "gzip"
+    
+    # Stream CSV as downloadable file
+    return StreamingResponse(csv_chunks, media_type="text/csv", headers=headers)
+
+
+@app.get("/csv/{api_key}/{src}.csv", dependencies=[Depends(verify_api_key)])
 async def get_csv(
-    api_key: str,
+    request: Request,
     src: str
 ):
     """
@@ -296,24 +470,30 @@ async def get_csv(
     
     Exemplo: /csv/sua-api-key/7871141994.csv
     """
-    # Validate API key
-    if api_key != settings.API_KEY:
-        print(f"❌ Tentativa de acesso não autorizado ao CSV {src} com API key inválida")
-        raise HTTPException(status_code=401, detail="API Key inválida")
+    # Validators come before the content, so a tag never claims a newer revision
+    stat = await run_io(csv_handler.stat_csv, src)
+    
+    if stat is None:
+        raise HTTPException(status_code=404, detail=f"CSV não encontrado para conta {src}")
+    
+    # Google Ads polls the same file repeatedly; unchanged files cost only headers
+    if _not_modified(request, stat):
+        return _not_modified_response(stat)
     
     # Get CSV content
-    csv_content = csv_handler.get_csv_content(src)
+    csv_chunks = await run_io(csv_handler.iter_csv_content, src)
     
-    if csv_content is None:
+    if csv_chunks is None:
         raise HTTPException(status_code=404, detail=f"CSV não encontrado para conta {src}")
     
-    
-    # Return CSV as downloadable file
-    return Response(
-        content=csv_content,
+    # Stream CSV as downloadable file; rows are already in memory, so chunks
+    # are rendered on the loop rather than one threadpool hop each
+    return StreamingResponse(
+        _iter_in_loop(csv_chunks),
         media_type="text/csv",
         headers={
-            "Content-Disposition": f"attachment; filename={src}.csv"
+            "Content-Disposition": f"attachment; filename={src}.csv",
+            **_validator_headers(stat)
         }
     )
 
@@ -334,67 +514,45 @@ async def manual_cleanup(
         hours: Number of hours threshold (default: 25)
     """
     try:
-        results = csv_handler.cleanup_old_conversions(src, hours)
-        
-        print(f"🧹 Limpeza manual executada por {username} - Conta: {src}")
-        
-        return CleanupResponse(
-            success=True,
-            src=src,
-            archived=results['archived'],
-            remaining=results['remaining'],
-            message=f"Arquivadas {results['archived']} conversões antigas"
-        )
+        results = await run_io(csv_handler.cleanup_old_conversions, src, hours)
     except Exception as e:
-        print(f"❌ Erro na limpeza manual: {e}")
+        log.error("❌ Erro na limpeza manual: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao executar limpeza: {str(e)}")
-
-
-@app.get("/csv/{api_key}/{src}_history.csv")
-async def get_history_csv(
-    api_key: str,
-    src: str
-):
-    """
-    Return history CSV for a specific account
-    For audit purposes only, not used by Google Ads
-    
-    Args:
-        api_key: API key for authentication (in path)
-        src: Source/Account ID
-    
-    Example: /csv/your-api-key/7871141994_history.csv
-    """
-    # Validate API key
-    if api_key != settings.API_KEY:
-        print(f"❌ Tentativa de acesso não autorizado ao histórico {src} com API key inválida")
-        raise HTTPException(status_code=401, detail="API Key inválida")
     
-    # Get history CSV content
-    csv_content = csv_handler.get_csv_content(f"{src}_history")
+    if results['failed']:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao arquivar {results['failed']} conversões antigas; mantidas no CSV"
+        )
     
-    if csv_content is None:
-        raise HTTPException(status_code=404, detail=f"Histórico não encontrado para conta {src}")
+    log.info("🧹 Limpeza manual executada por %s - Conta: %s", username, src)
     
-    # Return CSV as downloadable file
-    return Response(
-        content=csv_content,
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={src}_history.csv"
-        }
+    return CleanupResponse(
+        success=True,
+        src=src,
+        archived=results['archived'],
+        remaining=results['remaining'],
+        message=f"Arquivadas {results['archived']} conversões antigas"
     )
 
 
+# /health body with only the timestamp and scheduler state filled per request
+_HEALTHY_TEMPLATE = b'{"status":"healthy","timestamp":"%s","service":%s,"scheduler_running":%s}'
+_SERVICE_B = orjson.dumps(settings.APP_NAME)
+# (timestamp, scheduler_running, body) of the last rendered health reply
+_cached_health = ("", False, b"")
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
-        "service": settings.APP_NAME,
-        "scheduler_running": scheduler.running
-    }
+    """Health check endpoint, re-rendered at most once per second"""
+    global _cached_health
+    now = _utc_now_iso()
+    running = scheduler.running
+    if _cached_health[0] != now or _cached_health[1] != running:
+        body = _HEALTHY_TEMPLATE % (now.encode(), _SERVICE_B, b"true" if running else b"false")
+        _cached_health = (now, running, body)
+    return Response(content=_cached_health[2], media_type="application/json")
 
 
 if __name__ == "__main__":
@@ -402,5 +560,12 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+        access_log=False,
+        # Single worker, as in the Procfile: each process buffers its own copy
+        # of the CSVs and flushes whole files, so workers would overwrite each other's rows
+        workers=1
     )
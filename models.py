@@ -1,35 +1,28 @@
 """
 Pydantic models for request validation
 """
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional
-from datetime import datetime
+import ciso8601
 
 
 class PostbackRequest(BaseModel):
     """Model for validating postback requests"""
     
+    # Bound straight from the query string; read-only, unknown params dropped
+    model_config = ConfigDict(frozen=True, extra="ignore")
+    
     # Required fields
     gclid: str = Field(..., description="Google Click ID", min_length=1)
     src: str = Field(..., description="Source/Account ID", min_length=1)
     
-    # Transaction details
+    # Transaction details; the only optional params add_conversion stores.
+    # utmSource is checked by the route dependency and other tracking params
+    # (productName, utmCampaign, upsellNo, ...) are ignored unparsed
     orderId: Optional[str] = None
     commission: Optional[float] = Field(None, ge=0, description="Commission value")
-    productName: Optional[str] = None
-    productId: Optional[str] = None
     dateTime: Optional[str] = None
     
-    # UTM parameters
-    utmSource: Optional[str] = None
-    utmCampaign: Optional[str] = None
-    utmMedium: Optional[str] = None
-    utmContent: Optional[str] = None
-    utmTerm: Optional[str] = None
-    
-    # Upsell info
-    upsellNo: Optional[int] = Field(None, ge=0)
-    
     @field_validator('src')
     @classmethod
     def validate_src(cls, v: str) -> str:
@@ -46,8 +39,9 @@ class PostbackRequest(BaseModel):
         if v is None:
             return None
         try:
-            # Try to parse the datetime to validate format
-            datetime.fromisoformat(v.replace('Z', '+00:00'))
+            # Same C parser add_conversion uses, so whatever passes here is
+            # stored as given instead of falling back to the current time
+            ciso8601.parse_datetime(v)
             return v
         except ValueError:
             raise ValueError('dateTime must be in ISO 8601 format')
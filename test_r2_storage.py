@@ -0,0 +1,121 @@
+"""
+Tests for the multipart history append, against a stubbed S3 client
+"""
+import gzip
+import os
+import sys
+from unittest.mock import MagicMock
+
+sys.path.insert(0, '.')
+
+# Settings are required at import; no request ever reaches these
+for name in ('R2_ACCOUNT_ID', 'R2_ACCESS_KEY_ID', 'R2_SECRET_ACCESS_KEY', 'R2_BUCKET_NAME',
+             'API_KEY', 'DASHBOARD_USERNAME', 'DASHBOARD_PASSWORD'):
+    os.environ.setdefault(name, 'test')
+
+from csv_handler import CSVHandler, HEADER, MULTIPART_MIN_PART_SIZE, R2Storage
+
+
+def _stub_client() -> MagicMock:
+    """S3 client stub whose multipart calls succeed"""
+    client = MagicMock()
+    client.exceptions.NoSuchKey = type('NoSuchKey', (Exception,), {})
+    client.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+    client.upload_part_copy.return_value = {'CopyPartResult': {'ETag': '"copied"'}}
+    client.upload_part.return_value = {'ETag': '"appended"'}
+    return client
+
+
+def _storage(client: MagicMock) -> R2Storage:
+    storage = R2Storage()
+    storage.s3_client = client
+    storage.bucket_name = 'bucket'
+    return storage
+
+
+def test_append_csv_part_layout_and_metadata():
+    client = _stub_client()
+    storage = _storage(client)
+
+    assert storage.append_csv('5_history', b'\nrow-1\nrow-2', 12)
+
+    created = client.create_multipart_upload.call_args.kwargs
+    assert created['Key'] == '5_history.csv'
+    assert created['ContentEncoding'] == 'gzip'
+    assert created['Metadata'] == {'rowcount': '12', 'multimember': '1'}
+
+    # Part 1 is the existing object copied server-side
+    copied = client.upload_part_copy.call_args.kwargs
+    assert copied['PartNumber'] == 1
+    assert copied['UploadId'] == 'upload-1'
+    assert copied['CopySource'] == {'Bucket': 'bucket', 'Key': '5_history.csv'}
+
+    # Part 2 is the new content as its own gzip member
+    appended = client.upload_part.call_args.kwargs
+    assert appended['PartNumber'] == 2
+    assert gzip.decompress(appended['Body']) == b'\nrow-1\nrow-2'
+
+    completed = client.complete_multipart_upload.call_args.kwargs
+    assert completed['MultipartUpload'] == {'Parts': [
+        {'PartNumber': 1, 'ETag': '"copied"'},
+        {'PartNumber': 2, 'ETag': '"appended"'}
+    ]}
+    client.abort_multipart_upload.assert_not_called()
+
+
+def test_append_csv_aborts_failed_upload():
+    client = _stub_client()
+    client.upload_part.side_effect = ConnectionError('boom')
+    storage = _storage(client)
+
+    assert not storage.append_csv('5_history', b'\nrow-1', 1)
+    client.abort_multipart_upload.assert_called_once_with(
+        Bucket='bucket', Key='5_history.csv', UploadId='upload-1'
+    )
+    client.complete_multipart_upload.assert_not_called()
+
+
+def test_write_history_rewrites_when_append_fails():
+    client = _stub_client()
+    client.complete_multipart_upload.side_effect = ConnectionError('boom')
+    existing = HEADER + b'\nold-1\nold-2'
+    client.head_object.return_value = {
+        'ETag': '"history"',
+        'ContentLength': MULTIPART_MIN_PART_SIZE,
+        'ContentEncoding': 'gzip',
+        'Metadata': {'rowcount': '2'}
+    }
+    body = MagicMock()
+    body.read.return_value = gzip.compress(existing)
+    client.get_object.return_value = {'Body': body}
+
+    handler = CSVHandler()
+    handler.storage = _storage(client)
+
+    assert handler._write_history('5', [b'new-1'])
+
+    client.abort_multipart_upload.assert_called_once()
+    saved = client.put_object.call_args.kwargs
+    assert saved['Key'] == '5_history.csv'
+    assert gzip.decompress(saved['Body']) == existing + b'\nnew-1'
+    assert saved['Metadata'] == {'rowcount': '3'}
+
+
+def test_write_history_keeps_completed_append():
+    client = _stub_client()
+    client.complete_multipart_upload.side_effect = ConnectionError('response lost')
+    head = {
+        'ETag': '"history"',
+        'ContentLength': MULTIPART_MIN_PART_SIZE,
+        'ContentEncoding': 'gzip',
+        'Metadata': {'rowcount': '2'}
+    }
+    # The second HEAD sees the object the lost response had completed
+    client.head_object.side_effect = [head, {**head, 'ETag': '"history-2"'}]
+
+    handler = CSVHandler()
+    handler.storage = _storage(client)
+
+    assert handler._write_history('5', [b'new-1'])
+    client.get_object.assert_not_called()
+    client.put_object.assert_not_called()